@@ -5,25 +5,61 @@ Sends data to TCP server and measures latency and throughput
 """
 
 import socket
+import struct
 import time
-import json
 import sys
-from datetime import datetime
+from array import array
+from dataclasses import dataclass, field, fields
+
+import numpy as np
+import orjson
+
+# Per-message metric series saved as .npy instead of JSON
+ARRAY_METRICS = ('latencies', 'send_times')
+
+# Length prefix sent ahead of each payload in framed mode
+FRAME_HEADER = struct.Struct('!I')
+
+# Test payloads shared across runs, keyed by size; other sizes are added
+# on first use
+_PAYLOAD_POOL = {size: b"X" * size for size in (64, 128, 256, 512, 1024, 4096, 16384)}
+
+def get_payload(size):
+    """Return a zero-copy view of the shared payload of `size` bytes"""
+    payload = _PAYLOAD_POOL.get(size)
+    if payload is None:
+        payload = _PAYLOAD_POOL[size] = b"X" * size
+    return memoryview(payload)
+
+@dataclass(slots=True)
+class ClientMetrics:
+    """Client-side counters, updated on every message"""
+    total_messages_sent: int = 0
+    total_bytes_sent: int = 0
+    latencies: array = field(default_factory=lambda: array('q'))  # Round-trip times (ns)
+    send_times: list = field(default_factory=list)  # Wall-clock time_ns() at each send
+    start_time: float | None = None
+    end_time: float | None = None
+    failed_messages: int = 0
 
 class TCPClient:
-    def __init__(self, host='127.0.0.1', port=5000):
+    def __init__(self, host='127.0.0.1', port=5000, verbose=False, buf_size=None,
+                 framed=False):
         self.host = host
         self.port = port
+        self.buf_size = buf_size  # SO_SNDBUF/SO_RCVBUF; None keeps kernel autotuning
+        self.verbose = verbose  # Per-message logging; off for benchmarking
+        self.framed = framed  # Length-prefix each message; server must match
         self.socket = None
-        self.metrics = {
-            'total_messages_sent': 0,
-            'total_bytes_sent': 0,
-            'latencies': [],  # Round-trip times for each message
-            'send_times': [],
-            'start_time': None,
-            'end_time': None,
-            'failed_messages': 0
-        }
+        self._sock_sendall = None
+        self._sock_sendmsg = None
+        self._send_payload = None
+        self._sock_recv_into = None
+        self._ack_buf = None
+        self.metrics = ClientMetrics()
+        # Write cursor into the preallocated latency store
+        self._latencies = self.metrics.latencies
+        self._lat_idx = 0
         
     def connect(self):
         """Establish connection to TCP server"""
@@ -31,11 +67,31 @@ class TCPClient:
             # Create TCP socket
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             
+            # Disable Nagle's algorithm - small request/response messages
+            # would otherwise stall on delayed ACKs
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            
+            # Size kernel buffers before connect() so the window scale covers them
+            if self.buf_size is not None:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.buf_size)
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.buf_size)
+            
             # Connect to server
             print(f"[TCP CLIENT] Connecting to {self.host}:{self.port}...")
             self.socket.connect((self.host, self.port))
             print(f"[TCP CLIENT] Connected successfully!\n")
             
+            # Cache bound socket methods to skip attribute lookups per message
+            self._sock_sendall = self.socket.sendall
+            self._sock_sendmsg = self.socket.sendmsg
+            self._sock_recv_into = self.socket.recv_into
+            
+            # Pick the send path once instead of branching per message
+            self._send_payload = self._send_framed if self.framed else self._sock_sendall
+            
+            # Reusable receive buffer for ACKs (well under 64 bytes)
+            self._ack_buf = bytearray(64)
+            
             return True
             
         except Exception as e:
@@ -44,60 +100,82 @@ class TCPClient:
             
     def send_message(self, message):
         """Send a single message and measure latency"""
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        return self.send_message_bytes(message)
+        
+    def send_message_bytes(self, message_bytes):
+        """Send a pre-encoded message and measure latency (hot path)"""
         try:
-            # Record send time
-            send_start = time.time()
+            # Record send time: wall clock for the exported series (comparable
+            # with the server's message_timestamps), monotonic for latency
+            send_time = time.time_ns()
+            send_start = time.perf_counter_ns()
             
             # Send message
-            if isinstance(message, str):
-                message_bytes = message.encode('utf-8')
-            else:
-                message_bytes = message
-                
-            self.socket.send(message_bytes)
+            self._send_payload(message_bytes)
             
             # Wait for acknowledgment
-            ack = self.socket.recv(1024)
+            if not self._sock_recv_into(self._ack_buf, 64):
+                raise ConnectionError("server closed the connection")
             
             # Record receive time and calculate latency
-            send_end = time.time()
+            send_end = time.perf_counter_ns()
             latency = send_end - send_start
             
             # Update metrics
-            self.metrics['total_messages_sent'] += 1
-            self.metrics['total_bytes_sent'] += len(message_bytes)
-            self.metrics['latencies'].append(latency)
-            self.metrics['send_times'].append(send_start)
+            self.metrics.total_messages_sent += 1
+            self.metrics.total_bytes_sent += len(message_bytes)
+            if self._lat_idx < len(self._latencies):
+                self._latencies[self._lat_idx] = latency
+            else:
+                self._latencies.append(latency)
+            self._lat_idx += 1
+            self.metrics.send_times.append(send_time)
             
             return True, latency
             
         except Exception as e:
-            print(f"[TCP CLIENT ERROR] Send failed: {e}")
-            self.metrics['failed_messages'] += 1
+            if self.verbose:
+                print(f"[TCP CLIENT ERROR] Send failed: {e}")
+            self.metrics.failed_messages += 1
             return False, 0
             
+    def _send_framed(self, message_bytes):
+        """Send a length header and the payload in one scatter-gather syscall"""
+        header = FRAME_HEADER.pack(len(message_bytes))
+        sent = self._sock_sendmsg([header, message_bytes])
+        
+        # sendmsg() may write short, just like send()
+        if sent < len(header) + len(message_bytes):
+            self._sock_sendall((header + message_bytes)[sent:])
+            
     def send_bulk_messages(self, num_messages=100, message_size=1024):
         """Send multiple messages for performance testing"""
         print(f"[TCP CLIENT] Starting bulk send test...")
         print(f"[TCP CLIENT] Messages: {num_messages}, Size: {message_size} bytes\n")
         
-        self.metrics['start_time'] = time.time()
+        # Preallocate before the clock starts so it isn't measured
+        self._reserve_latencies(num_messages)
+        
+        self.metrics.start_time = time.perf_counter()
         
-        # Generate test message
-        test_message = "X" * message_size
+        # Shared test message, sent without copying
+        test_message = get_payload(message_size)
         
         # Send messages
         for i in range(num_messages):
-            success, latency = self.send_message(test_message)
+            success, latency = self.send_message_bytes(test_message)
             
             if success:
                 if (i + 1) % 10 == 0:  # Print progress every 10 messages
                     print(f"[TCP CLIENT] Sent {i + 1}/{num_messages} messages, "
-                          f"Last latency: {latency*1000:.2f} ms")
-            else:
+                          f"Last latency: {latency / 1e6:.2f} ms")
+            elif self.verbose:
                 print(f"[TCP CLIENT] Failed to send message {i + 1}")
                 
-        self.metrics['end_time'] = time.time()
+        self.metrics.end_time = time.perf_counter()
+        self._trim_latencies()
         
         print(f"\n[TCP CLIENT] Bulk send complete!\n")
         
@@ -107,37 +185,52 @@ class TCPClient:
         print(f"[TCP CLIENT] Duration: {duration_seconds}s, "
               f"Rate: {messages_per_second} msg/s, Size: {message_size} bytes\n")
         
-        self.metrics['start_time'] = time.time()
+        # Preallocate before the clock starts so it isn't measured
+        self._reserve_latencies(int(duration_seconds * messages_per_second) + 1)
         
-        # Generate test message
-        test_message = "Y" * message_size
+        self.metrics.start_time = time.perf_counter()
         
-        # Calculate inter-message delay
-        delay = 1.0 / messages_per_second
+        # Shared test message, sent without copying
+        test_message = get_payload(message_size)
         
-        end_time = time.time() + duration_seconds
+        # Calculate inter-message delay and the test deadline in nanoseconds
+        delay_ns = 1_000_000_000 // messages_per_second
+        duration_ns = duration_seconds * 1_000_000_000
+        
+        t0 = time.perf_counter_ns()
         message_count = 0
         
-        while time.time() < end_time:
-            send_start = time.time()
-            
-            success, latency = self.send_message(test_message)
+        while time.perf_counter_ns() - t0 < duration_ns:
+            success, latency = self.send_message_bytes(test_message)
             message_count += 1
             
             if success and message_count % messages_per_second == 0:
-                elapsed = time.time() - self.metrics['start_time']
+                elapsed = time.perf_counter() - self.metrics.start_time
                 print(f"[TCP CLIENT] {message_count} messages sent in {elapsed:.1f}s, "
-                      f"Last latency: {latency*1000:.2f} ms")
+                      f"Last latency: {latency / 1e6:.2f} ms")
             
-            # Sleep to maintain desired rate
-            elapsed = time.time() - send_start
-            if elapsed < delay:
-                time.sleep(delay - elapsed)
+            # Sleep until this message's slot on an absolute schedule, so
+            # per-iteration overhead never accumulates into rate drift
+            next_deadline = t0 + message_count * delay_ns
+            sleep_s = (next_deadline - time.perf_counter_ns()) / 1e9
+            if sleep_s > 0:
+                time.sleep(sleep_s)
                 
-        self.metrics['end_time'] = time.time()
+        self.metrics.end_time = time.perf_counter()
+        self._trim_latencies()
         
         print(f"\n[TCP CLIENT] Variable load test complete!\n")
         
+    def _reserve_latencies(self, count):
+        """Grow the latency store so `count` more samples fit without resizing"""
+        spare = len(self._latencies) - self._lat_idx
+        if spare < count:
+            self._latencies.frombytes(bytes(self._latencies.itemsize * (count - spare)))
+            
+    def _trim_latencies(self):
+        """Drop preallocated latency slots that were never filled"""
+        del self._latencies[self._lat_idx:]
+        
     def disconnect(self):
         """Close connection to server"""
         if self.socket:
@@ -150,45 +243,49 @@ class TCPClient:
         print("TCP CLIENT PERFORMANCE METRICS")
         print("="*60)
         
-        if self.metrics['start_time'] and self.metrics['end_time']:
-            duration = self.metrics['end_time'] - self.metrics['start_time']
+        # A test interrupted mid-run leaves unfilled slots behind
+        self._trim_latencies()
+        
+        if self.metrics.start_time and self.metrics.end_time:
+            duration = self.metrics.end_time - self.metrics.start_time
             print(f"Duration: {duration:.2f} seconds")
             
-        print(f"Total Messages Sent: {self.metrics['total_messages_sent']}")
-        print(f"Total Bytes Sent: {self.metrics['total_bytes_sent']:,} bytes")
-        print(f"Failed Messages: {self.metrics['failed_messages']}")
+        print(f"Total Messages Sent: {self.metrics.total_messages_sent}")
+        print(f"Total Bytes Sent: {self.metrics.total_bytes_sent:,} bytes")
+        print(f"Failed Messages: {self.metrics.failed_messages}")
         
-        if len(self.metrics['latencies']) > 0:
-            latencies_ms = [l * 1000 for l in self.metrics['latencies']]
-            avg_latency = sum(latencies_ms) / len(latencies_ms)
-            min_latency = min(latencies_ms)
-            max_latency = max(latencies_ms)
+        if len(self.metrics.latencies) > 0:
+            latencies_ms = np.frombuffer(self.metrics.latencies, dtype=np.int64) * 1e-6
+            avg_latency = latencies_ms.mean()
+            min_latency = latencies_ms.min()
+            max_latency = latencies_ms.max()
             
             print(f"\nLatency Statistics:")
             print(f"  Average: {avg_latency:.2f} ms")
             print(f"  Min: {min_latency:.2f} ms")
             print(f"  Max: {max_latency:.2f} ms")
             
-            # Calculate percentiles
-            sorted_latencies = sorted(latencies_ms)
-            p50 = sorted_latencies[len(sorted_latencies) // 2]
-            p95 = sorted_latencies[int(len(sorted_latencies) * 0.95)]
-            p99 = sorted_latencies[int(len(sorted_latencies) * 0.99)]
+            # Calculate percentiles by selecting all three ranks in one
+            # O(n) partition instead of sorting
+            n = len(latencies_ms)
+            ranks = [n // 2, int(n * 0.95), int(n * 0.99)]
+            latencies_ms.partition(ranks)
+            p50, p95, p99 = latencies_ms[ranks]
             
             print(f"  P50: {p50:.2f} ms")
             print(f"  P95: {p95:.2f} ms")
             print(f"  P99: {p99:.2f} ms")
             
-        if self.metrics['total_messages_sent'] > 0 and self.metrics['start_time']:
-            duration = self.metrics['end_time'] - self.metrics['start_time']
+        if self.metrics.total_messages_sent > 0 and self.metrics.start_time:
+            duration = self.metrics.end_time - self.metrics.start_time
             if duration > 0:
-                msg_per_sec = self.metrics['total_messages_sent'] / duration
-                throughput = (self.metrics['total_bytes_sent'] * 8) / duration / 1_000_000  # Mbps
+                msg_per_sec = self.metrics.total_messages_sent / duration
+                throughput = (self.metrics.total_bytes_sent * 8) / duration / 1_000_000  # Mbps
                 
                 print(f"\nThroughput:")
                 print(f"  Messages per Second: {msg_per_sec:.2f}")
                 print(f"  Throughput: {throughput:.2f} Mbps")
-                print(f"  Average Message Size: {self.metrics['total_bytes_sent'] / self.metrics['total_messages_sent']:.2f} bytes")
+                print(f"  Average Message Size: {self.metrics.total_bytes_sent / self.metrics.total_messages_sent:.2f} bytes")
         
         print("="*60 + "\n")
         
@@ -196,16 +293,26 @@ class TCPClient:
         self.save_metrics()
         
     def save_metrics(self):
-        """Save metrics to JSON file for analysis"""
-        metrics_file = f"tcp_client_metrics_{int(time.time())}.json"
+        """Save scalar metrics to JSON and per-message arrays to .npy files"""
+        prefix = f"tcp_client_metrics_{int(time.time())}"
+        metrics_file = f"{prefix}.json"
         
-        with open(metrics_file, 'w') as f:
-            json.dump(self.metrics, f, indent=2)
+        # Per-message series are stored in binary form, skipping all
+        # float-to-text conversion; the JSON only keeps the scalars
+        for key in ARRAY_METRICS:
+            array_file = f"{prefix}_{key}.npy"
+            np.save(array_file, np.asarray(getattr(self.metrics, key), dtype=np.int64))
+            print(f"[TCP CLIENT] {key} saved to {array_file}")
+            
+        summary = {f.name: getattr(self.metrics, f.name) for f in fields(self.metrics)
+                   if f.name not in ARRAY_METRICS}
+        with open(metrics_file, 'wb') as f:
+            f.write(orjson.dumps(summary))
             
         print(f"[TCP CLIENT] Metrics saved to {metrics_file}")
         
     def get_metrics(self):
-        """Return metrics dictionary"""
+        """Return the metrics container"""
         return self.metrics
 
 def main():
@@ -4,108 +4,350 @@ TCP Server Implementation with Performance Metrics
 Measures latency, throughput, and connection handling performance
 """
 
+import asyncio
+import collections
+import itertools
+import os
+import signal
 import socket
+import struct
+import sys
 import time
-import json
-import threading
-from datetime import datetime
+from array import array
+from dataclasses import dataclass, field, fields
+
+import orjson
+
+# uvloop is optional: its libuv-based event loop moves the accept/read/write
+# machinery into C. Used only when requested with use_uvloop=True
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Size of the reusable receive buffer held by each active connection
+RECV_BUFFER_SIZE = 65536
+
+# Print a progress line every N messages when not in verbose mode
+PROGRESS_INTERVAL = 1000
+
+# Length prefix sent ahead of each payload in framed mode
+FRAME_HEADER = struct.Struct('!I')
+
+# Per-message metric series saved as .bin instead of JSON
+ARRAY_METRICS = ('message_timestamps',)
+
+# Largest frame payload accepted; anything bigger means the client is not
+# sending length-prefixed frames (e.g. framing modes do not match)
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+# Acknowledgment sent for every message; the client only waits for it
+# and never parses it, so one preencoded constant serves every reply
+ACK_MESSAGE = b"ACK"
+
+@dataclass(slots=True)
+class ServerMetrics:
+    """Server-side counters, updated on every message"""
+    total_connections: int = 0
+    total_bytes_received: int = 0
+    total_messages: int = 0
+    start_time: float | None = None
+    end_time: float | None = None
+    message_timestamps: array = field(default_factory=lambda: array('d'))  # Wall-clock receive times
+
+class ClientConnection(asyncio.BufferedProtocol):
+    """Per-connection protocol that receives into one reusable buffer"""
+    
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.client_address = None
+        self.active = False  # False while queued behind max_connections
+        self.view = None  # Receive buffer, only held while active
+        
+        # Framed-mode parser state, carried across reads
+        self._header = bytearray(FRAME_HEADER.size)
+        self._header_len = 0
+        self._frame_size = 0
+        self._frame_remaining = 0
+        
+    def connection_made(self, transport):
+        self.transport = transport
+        self.client_address = transport.get_extra_info('peername')
+        client_socket = transport.get_extra_info('socket')
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.client_connected(self)
+        
+    def get_buffer(self, sizehint):
+        # Hand the event loop the same buffer every time: recv_into() fills it
+        # in place, so no bytes object is allocated per read
+        return self.view
+        
+    def buffer_updated(self, nbytes):
+        if not self.server.framed:
+            self.server.handle_client(self, nbytes)
+            return
+            
+        for frame_size in self._complete_frames(nbytes):
+            self.server.handle_client(self, frame_size)
+            
+    def _complete_frames(self, nbytes):
+        """Parse length-prefixed frames in place, yielding each finished payload size"""
+        pos = 0
+        while pos < nbytes:
+            if self._header_len < FRAME_HEADER.size:
+                # Headers may be split across reads, so accumulate them
+                take = min(FRAME_HEADER.size - self._header_len, nbytes - pos)
+                self._header[self._header_len:self._header_len + take] = self.view[pos:pos + take]
+                self._header_len += take
+                pos += take
+                if self._header_len < FRAME_HEADER.size:
+                    break
+                (self._frame_size,) = FRAME_HEADER.unpack(self._header)
+                if self._frame_size > MAX_FRAME_SIZE:
+                    print(f"[TCP SERVER ERROR] {self.client_address} sent a {self._frame_size}-byte "
+                          f"frame header (max {MAX_FRAME_SIZE}); is the client framed?")
+                    self.transport.close()
+                    return
+                self._frame_remaining = self._frame_size
+                
+            # Payload bytes are only counted, never copied out of the buffer
+            take = min(self._frame_remaining, nbytes - pos)
+            self._frame_remaining -= take
+            pos += take
+            if not self._frame_remaining:
+                self._header_len = 0
+                yield self._frame_size
+        
+    def connection_lost(self, exc):
+        self.server.client_disconnected(self, exc)
 
 class TCPServer:
-    def __init__(self, host='127.0.0.1', port=5000):
+    def __init__(self, host='127.0.0.1', port=5000, verbose=False, buf_size=None,
+                 num_workers=1, framed=False, max_connections=64, backlog=1024,
+                 use_uvloop=False):
         self.host = host
         self.port = port
-        self.server_socket = None
-        self.metrics = {
-            'total_connections': 0,
-            'total_bytes_received': 0,
-            'total_messages': 0,
-            'start_time': None,
-            'end_time': None,
-            'message_timestamps': []
-        }
+        self.buf_size = buf_size  # SO_SNDBUF/SO_RCVBUF; None keeps kernel autotuning
+        self.verbose = verbose  # Per-message logging; off for benchmarking
+        self.num_workers = num_workers  # Processes sharing the port via SO_REUSEPORT
+        self.framed = framed  # Expect length-prefixed messages; client must match
+        self.max_connections = max_connections  # Served concurrently; extras wait
+        self.backlog = backlog  # Kernel accept queue length
+        # uvloop.run() needs uvloop >= 0.18; otherwise fall back to asyncio
+        self.use_uvloop = use_uvloop and hasattr(uvloop, 'run')
+        if use_uvloop and not self.use_uvloop:
+            print("[TCP SERVER] uvloop >= 0.18 not available, using the asyncio event loop")
+        self._active_connections = 0
+        self._waiting_connections = collections.deque()
+        self.worker_id = 0
+        self._worker_pids = []
+        self._stopping = False
+        self.server = None
+        self._message_ids = itertools.count(1)
+        self.metrics = ServerMetrics()
         
     def start(self):
         """Start the TCP server"""
+        self.spawn_workers()
+        self.pin_to_cpu()
+        
         try:
-            # Create TCP socket
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            # Bind to address and port
-            self.server_socket.bind((self.host, self.port))
-            
-            # Listen for connections (max 5 queued connections)
-            self.server_socket.listen(5)
-            
-            print(f"[TCP SERVER] Started on {self.host}:{self.port}")
-            print(f"[TCP SERVER] Waiting for connections...")
-            
-            self.metrics['start_time'] = time.time()
-            
-            # Accept connections
-            while True:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    self.metrics['total_connections'] += 1
-                    print(f"\n[TCP SERVER] Connection #{self.metrics['total_connections']} from {client_address}")
-                    
-                    # Handle client in a new thread
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address)
-                    )
-                    client_thread.start()
-                    
-                except KeyboardInterrupt:
-                    print("\n[TCP SERVER] Shutting down...")
-                    break
-                    
+            if self.use_uvloop:
+                uvloop.run(self.serve())
+            else:
+                asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\n[TCP SERVER] Shutting down...")
         except Exception as e:
             print(f"[TCP SERVER ERROR] {e}")
         finally:
-            self.cleanup()
+            if self.worker_id:
+                # Forked workers must not return into the caller's code
+                try:
+                    self.cleanup()
+                finally:
+                    sys.stdout.flush()
+                    os._exit(0)
+                    
+            self.stop_workers()
             
-    def handle_client(self, client_socket, client_address):
-        """Handle individual client connection"""
+    def stop_workers(self):
+        """Stop forked workers, report our metrics, then reap them"""
+        # Shutdown may have reached only this process (e.g. kill -INT <pid>);
+        # workers ignore SIGINT and stop on SIGTERM
+        self._signal_workers(signal.SIGTERM)
+        
+        self.cleanup()
+        
+        if not self._worker_pids:
+            return
+            
+        print(f"[TCP SERVER] Waiting for {len(self._worker_pids)} worker(s) to exit...")
         try:
-            while True:
-                # Receive data from client
-                data = client_socket.recv(4096)
-                
-                if not data:
-                    break
-                    
-                # Record timestamp for latency calculation
-                receive_time = time.time()
-                self.metrics['message_timestamps'].append(receive_time)
-                
-                # Update metrics
-                self.metrics['total_bytes_received'] += len(data)
-                self.metrics['total_messages'] += 1
-                
-                # Decode and print received message
+            for pid in self._worker_pids:
+                os.waitpid(pid, 0)
+        except KeyboardInterrupt:
+            print("[TCP SERVER] Interrupted again, killing workers")
+            self._signal_workers(signal.SIGKILL)
+            for pid in self._worker_pids:
                 try:
-                    message = data.decode('utf-8')
-                    print(f"[TCP SERVER] Received: {message[:50]}... ({len(data)} bytes)")
-                except:
-                    print(f"[TCP SERVER] Received binary data ({len(data)} bytes)")
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass  # Already reaped above
+                    
+    def _signal_workers(self, signum):
+        """Send signum to every forked worker that is still running"""
+        for pid in self._worker_pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
                 
-                # Send acknowledgment back to client
-                ack = f"ACK:{self.metrics['total_messages']}"
-                client_socket.send(ack.encode('utf-8'))
+    def request_stop(self):
+        """Stop serving; the worker's SIGTERM handler"""
+        print("\n[TCP SERVER] Shutting down...")
+        self._stopping = True
+        if self.server:
+            self.server.close()
+            
+    def spawn_workers(self):
+        """Fork num_workers - 1 child processes that serve the same port"""
+        for worker_id in range(1, self.num_workers):
+            pid = os.fork()
+            if pid == 0:
+                # A terminal Ctrl-C reaches every worker as well as the
+                # parent; workers leave shutdown to the parent's SIGTERM
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                self.worker_id = worker_id
+                self._worker_pids = []
+                return
+            self._worker_pids.append(pid)
+            
+    def pin_to_cpu(self):
+        """Pin this worker to its own CPU to avoid cross-core migration"""
+        if not hasattr(os, 'sched_setaffinity'):
+            return
+            
+        cpus = sorted(os.sched_getaffinity(0))
+        cpu = cpus[self.worker_id % len(cpus)]
+        os.sched_setaffinity(0, {cpu})
+        print(f"[TCP SERVER] Worker {self.worker_id} pinned to CPU {cpu}")
+        
+    async def serve(self):
+        """Accept and serve connections on a single-threaded event loop"""
+        if self.worker_id:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.request_stop)
+            
+        # Create TCP socket
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.num_workers > 1:
+            # Each worker binds its own listening socket; the kernel
+            # load-balances incoming connections across them
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        try:
+            # Size kernel buffers before listen() so accepted sockets inherit them
+            if self.buf_size is not None:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.buf_size)
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.buf_size)
                 
-        except Exception as e:
-            print(f"[TCP SERVER ERROR] Client handler: {e}")
-        finally:
-            client_socket.close()
-            print(f"[TCP SERVER] Connection from {client_address} closed")
+            # Bind to address and port
+            server_socket.bind((self.host, self.port))
+            server_socket.setblocking(False)
+            
+            loop = asyncio.get_running_loop()
+            self.server = await loop.create_server(
+                lambda: ClientConnection(self), sock=server_socket, backlog=self.backlog
+            )
+        except Exception:
+            server_socket.close()
+            raise
+        
+        print(f"[TCP SERVER] Started on {self.host}:{self.port} ({'uvloop' if self.use_uvloop else 'asyncio'} event loop)")
+        print(f"[TCP SERVER] Waiting for connections...")
+        
+        self.metrics.start_time = time.perf_counter()
+        
+        async with self.server:
+            if self._stopping:
+                return  # SIGTERM arrived while the socket was being set up
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                # request_stop() closing the server cancels serve_forever()
+                if not self._stopping:
+                    raise
+            
+    def client_connected(self, connection):
+        """Register a newly accepted client connection"""
+        self.metrics.total_connections += 1
+        print(f"\n[TCP SERVER] Connection #{self.metrics.total_connections} from {connection.client_address}")
+        
+        # Bound the number of connections served at once; the rest stay
+        # accepted but unread, and hold no receive buffer, until a slot
+        # frees up. Receive buffer memory is capped at max_connections
+        if self._active_connections >= self.max_connections:
+            connection.transport.pause_reading()
+            self._waiting_connections.append(connection)
+            print(f"[TCP SERVER] {connection.client_address} queued, "
+                  f"{self.max_connections} connections already active")
+        else:
+            self._active_connections += 1
+            connection.active = True
+            connection.view = memoryview(bytearray(RECV_BUFFER_SIZE))
+            
+    def handle_client(self, connection, nbytes):
+        """Account for data received from a client and acknowledge it"""
+        # Record wall-clock timestamp (exported with the metrics)
+        receive_time = time.time()
+        self.metrics.message_timestamps.append(receive_time)
+        
+        # Update metrics (handlers share one thread, so no lock is needed)
+        message_id = next(self._message_ids)
+        self.metrics.total_bytes_received += nbytes
+        self.metrics.total_messages = message_id
+        
+        if self.verbose and self.framed:
+            # The read buffer holds headers and other frames, not this payload
+            print(f"[TCP SERVER] Received frame ({nbytes} bytes)")
+        elif self.verbose:
+            message = bytes(connection.view[:min(nbytes, 50)]).decode('utf-8', 'replace')
+            print(f"[TCP SERVER] Received: {message}... ({nbytes} bytes)")
+        elif message_id % PROGRESS_INTERVAL == 0:
+            print(f"[TCP SERVER] {message_id} messages received")
+        
+        # Send acknowledgment back to client
+        connection.transport.write(ACK_MESSAGE)
+        
+    def client_disconnected(self, connection, exc):
+        """Report a closed client connection"""
+        if exc:
+            print(f"[TCP SERVER ERROR] Client handler: {exc}")
+        print(f"[TCP SERVER] Connection from {connection.client_address} closed")
+        
+        if not connection.active:
+            self._waiting_connections.remove(connection)
+            return
+            
+        # Hand the freed slot, and its buffer, to the longest-waiting connection
+        view, connection.view = connection.view, None
+        if self._waiting_connections:
+            waiting = self._waiting_connections.popleft()
+            waiting.active = True
+            waiting.view = view
+            waiting.transport.resume_reading()
+        else:
+            self._active_connections -= 1
             
     def cleanup(self):
         """Clean up resources and display metrics"""
-        self.metrics['end_time'] = time.time()
+        self.metrics.end_time = time.perf_counter()
         
-        if self.server_socket:
-            self.server_socket.close()
+        if self.server:
+            self.server.close()
             
         # Calculate and display metrics
         self.display_metrics()
@@ -116,22 +358,25 @@ class TCPServer:
         print("TCP SERVER PERFORMANCE METRICS")
         print("="*60)
         
-        if self.metrics['start_time'] and self.metrics['end_time']:
-            duration = self.metrics['end_time'] - self.metrics['start_time']
+        if self.num_workers > 1:
+            print(f"Worker: {self.worker_id} of {self.num_workers}")
+        
+        if self.metrics.start_time and self.metrics.end_time:
+            duration = self.metrics.end_time - self.metrics.start_time
             print(f"Duration: {duration:.2f} seconds")
             
-        print(f"Total Connections: {self.metrics['total_connections']}")
-        print(f"Total Messages Received: {self.metrics['total_messages']}")
-        print(f"Total Bytes Received: {self.metrics['total_bytes_received']:,} bytes")
+        print(f"Total Connections: {self.metrics.total_connections}")
+        print(f"Total Messages Received: {self.metrics.total_messages}")
+        print(f"Total Bytes Received: {self.metrics.total_bytes_received:,} bytes")
         
-        if self.metrics['total_messages'] > 0 and self.metrics['start_time']:
-            duration = self.metrics['end_time'] - self.metrics['start_time']
+        if self.metrics.total_messages > 0 and self.metrics.start_time:
+            duration = self.metrics.end_time - self.metrics.start_time
             if duration > 0:
-                msg_per_sec = self.metrics['total_messages'] / duration
-                throughput = (self.metrics['total_bytes_received'] * 8) / duration / 1_000_000  # Mbps
+                msg_per_sec = self.metrics.total_messages / duration
+                throughput = (self.metrics.total_bytes_received * 8) / duration / 1_000_000  # Mbps
                 print(f"Messages per Second: {msg_per_sec:.2f}")
                 print(f"Throughput: {throughput:.2f} Mbps")
-                print(f"Average Message Size: {self.metrics['total_bytes_received'] / self.metrics['total_messages']:.2f} bytes")
+                print(f"Average Message Size: {self.metrics.total_bytes_received / self.metrics.total_messages:.2f} bytes")
         
         print("="*60 + "\n")
         
@@ -139,11 +384,24 @@ class TCPServer:
         self.save_metrics()
         
     def save_metrics(self):
-        """Save metrics to JSON file for analysis"""
-        metrics_file = f"tcp_server_metrics_{int(time.time())}.json"
+        """Save scalar metrics to JSON and per-message arrays to raw .bin files"""
+        prefix = f"tcp_server_metrics_{int(time.time())}"
+        if self.num_workers > 1:
+            prefix = f"{prefix}_w{self.worker_id}"
+        metrics_file = f"{prefix}.json"
         
-        with open(metrics_file, 'w') as f:
-            json.dump(self.metrics, f, indent=2)
+        # Per-message series are stored in binary form (native-endian
+        # float64, readable with numpy.fromfile); the JSON only keeps scalars
+        for key in ARRAY_METRICS:
+            array_file = f"{prefix}_{key}.bin"
+            with open(array_file, 'wb') as f:
+                getattr(self.metrics, key).tofile(f)
+            print(f"[TCP SERVER] {key} saved to {array_file}")
+            
+        summary = {f.name: getattr(self.metrics, f.name) for f in fields(self.metrics)
+                   if f.name not in ARRAY_METRICS}
+        with open(metrics_file, 'wb') as f:
+            f.write(orjson.dumps(summary))
             
         print(f"[TCP SERVER] Metrics saved to {metrics_file}")
 